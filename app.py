@@ -1,11 +1,30 @@
 import streamlit as st
-from database import init_db, create_new_session, get_sessions, rename_session, delete_session, save_chat, load_chat_history
+from database import init_db, create_new_session, get_sessions, rename_session, delete_session, save_chat_async, pop_save_errors, load_chat_history_as_messages
 from auth import show_auth_page
-from chatbot import get_response
 
 # Initialize database
 init_db()
 
+# Cache the user's chat sessions between reruns; cleared whenever they change.
+# Returns a name -> id mapping and the tuple of names for the session selector.
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_sessions(username):
+    session_options = {session_name: session_id for session_id, session_name in get_sessions(username)}
+    return session_options, tuple(session_options)
+
+# Number of exchanges (user message + response) loaded per history page
+HISTORY_PAGE_SIZE = 15
+
+# Cache one page of chat history; returns the messages and whether older ones exist.
+# One extra exchange is fetched to tell whether an older page exists, then dropped.
+# New messages only change the latest page, so after a save only
+# _cached_history_page.clear(session_id) is needed.
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_history_page(session_id, before_id=None):
+    messages = load_chat_history_as_messages(session_id, HISTORY_PAGE_SIZE + 1, before_id)
+    has_more = len(messages) > 2 * HISTORY_PAGE_SIZE
+    return (messages[2:] if has_more else messages), has_more
+
 st.set_page_config(page_title="Heavenly DelusionZ", page_icon="💬", layout="wide")
 
 
@@ -21,26 +40,25 @@ show_auth_page()
 
 # **Handle Chat Sessions**
 if "authenticated" in st.session_state and st.session_state["authenticated"]:
+    from chatbot import PERSONA_OPTIONS, PERSONA_KEYS
+
     username = st.session_state["username"]  
 
+    # Report chat messages that failed to save in the background
+    for error in pop_save_errors(username):
+        st.error(f"A chat message could not be saved: {error}")
+
     # **Sidebar Section**
     st.sidebar.title(f"💬 {username}'s Chat Sessions")  
 
     # **Persona Selection**
     st.sidebar.markdown("### 🧠 Choose Your AI Persona")
-    persona_options = {
-        "Heavenly DelusionZ Counselor": "The balanced and supportive AI that provides empathetic yet structured mental health support.",
-        "Compassionate Listener": "A deeply empathetic AI that focuses on active listening and validation.",
-        "Motivational Coach": "A high-energy AI that encourages and empowers users to take action for self-improvement.",
-        "CBT Guide": "A rational AI that helps reframe negative thoughts using cognitive behavioral techniques."
-    }
-
-    selected_persona = st.sidebar.selectbox("Select a Persona:", list(persona_options.keys()), key="persona_select")
+    selected_persona = st.sidebar.selectbox("Select a Persona:", PERSONA_KEYS, key="persona_select")
     st.session_state["selected_persona"] = selected_persona  
-    st.sidebar.markdown(f"📝 *{persona_options[selected_persona]}*")
+    st.sidebar.markdown(f"📝 *{PERSONA_OPTIONS[selected_persona]}*")
 
     # Fetch user chat sessions
-    user_sessions = get_sessions(username)
+    session_options, session_names = _cached_sessions(username)
 
     # Clear selected session when changing sessions
     if "prev_session" not in st.session_state:
@@ -48,8 +66,7 @@ if "authenticated" in st.session_state and st.session_state["authenticated"]:
         st.session_state["selected_session"] = None
 
     # Display available chat sessions
-    session_options = {session_name: session_id for session_id, session_name in user_sessions}
-    selected_session_name = st.sidebar.radio("Select a chat:", list(session_options.keys()), key="session_select", index=None)
+    selected_session_name = st.sidebar.radio("Select a chat:", session_names, key="session_select", index=None)
 
     # Update selected session when user clicks
     if selected_session_name:
@@ -64,20 +81,26 @@ if "authenticated" in st.session_state and st.session_state["authenticated"]:
     if st.sidebar.button("🆕 New Chat"):
         new_session_id, new_session_name = create_new_session(username)
         if new_session_id:
+            _cached_sessions.clear()
             st.session_state["selected_session"] = new_session_id
             st.session_state["prev_session"] = new_session_id
             st.session_state.messages = []  # Clear messages for new chat
             st.rerun()
 
-    # Rename session
-    new_name = st.sidebar.text_input("Rename chat:", selected_session_name if selected_session_name else "")
-    if st.sidebar.button("Rename") and selected_session_name:
+    # Rename session (inside a form so typing does not rerun the app)
+    with st.sidebar.form("rename_form", clear_on_submit=True):
+        new_name = st.text_input("Rename chat:", selected_session_name if selected_session_name else "")
+        rename_submitted = st.form_submit_button("Rename")
+    if rename_submitted and selected_session_name:
         rename_session(st.session_state["selected_session"], new_name)
+        _cached_sessions.clear()
         st.rerun()
 
     # Delete session
     if st.sidebar.button("🗑️ Delete Chat") and selected_session_name:
         delete_session(st.session_state["selected_session"])
+        _cached_sessions.clear()
+        _cached_history_page.clear(st.session_state["selected_session"])
         st.session_state["selected_session"] = None
         st.session_state["prev_session"] = None
         st.session_state.messages = []  # Clear messages after deletion
@@ -85,24 +108,27 @@ if "authenticated" in st.session_state and st.session_state["authenticated"]:
 
     # **Display Chat Interface OR Welcome Message**
     if st.session_state["selected_session"]:
+        sid = st.session_state["selected_session"]
+        persona = st.session_state["selected_persona"]
         chat_container = st.container()
         
         with chat_container:
             st.write(f"💬 Chat Session: **{selected_session_name}**")
-            st.write(f"🧠 AI Persona: **{st.session_state['selected_persona']}**")  # Show selected persona
+            st.write(f"🧠 AI Persona: **{persona}**")  # Show selected persona
             
-            # Load chat history if messages list is empty
+            # Load the latest page of chat history if messages list is empty
             if not st.session_state.messages:
-                chat_history = load_chat_history(st.session_state["selected_session"])
-                # Add chat history to session state
-                for message, response in chat_history:
-                    st.session_state.messages.append({"role": "user", "content": message})
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+                st.session_state.messages, st.session_state["history_has_more"] = _cached_history_page(sid)
+            msgs = st.session_state.messages
             
             # Display all messages from session state
             messages_container = st.container()
             with messages_container:
-                for message in st.session_state.messages:
+                if st.session_state.get("history_has_more") and st.button("↑ Load older"):
+                    older_messages, st.session_state["history_has_more"] = _cached_history_page(sid, msgs[0]["id"])
+                    st.session_state.messages = older_messages + msgs
+                    st.rerun()
+                for message in msgs:
                     if message["role"] == "user":
                         st.chat_message("user", avatar="🌸").write(message["content"])
                     else:
@@ -112,30 +138,32 @@ if "authenticated" in st.session_state and st.session_state["authenticated"]:
         user_input = st.chat_input("Type your message here...")
         
         if user_input:
-            # Add user message to session state immediately
-            st.session_state.messages.append({"role": "user", "content": user_input})
-            
-            # Display the updated messages including the new user message
+            from chatbot import stream_response, throttle_stream
+
+            # Stream the AI response into the chat as it is generated
+            # Updates are batched so the placeholder is redrawn at most every 50ms,
+            # and shown as plain text until the reply is complete
             with messages_container:
-                for message in st.session_state.messages:
-                    if message["role"] == "user":
-                        st.chat_message("user", avatar="🌸").write(message["content"])
-                    else:
-                        st.chat_message("assistant", avatar="🤖").write(message["content"])
-            
-            # Show a spinner while waiting for the AI response
-            with st.spinner("AI is thinking..."):
-                # Get AI response
-                response = get_response(username, user_input, st.session_state["selected_persona"])
-                
-                # Add AI response to session state
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                
-                # Save conversation to database
-                save_chat(st.session_state["selected_session"], username, user_input, response)
-            
-            # Rerun to display the complete conversation including the new response
-            st.rerun()
+                st.chat_message("user", avatar="🌸").write(user_input)
+                placeholder = st.chat_message("assistant", avatar="🤖").empty()
+                response = ""
+                for text in throttle_stream(stream_response(username, user_input, persona)):
+                    response += text
+                    placeholder.text(response)
+                placeholder.markdown(response)
+
+            # Add the exchange to session state only once the reply is complete, so an
+            # interrupted stream does not leave a user message without a response
+            msgs.append({"role": "user", "content": user_input})
+            msgs.append({"role": "assistant", "content": response})
+
+            # Save conversation to database without holding up the UI;
+            # the history cache is cleared only once the row has been written
+            def clear_history_if_saved(future, session_id=sid):
+                if future.exception() is None:
+                    _cached_history_page.clear(session_id)
+
+            save_chat_async(sid, username, user_input, response).add_done_callback(clear_history_if_saved)
 
     else:
         welcome_container = st.container()
@@ -1,25 +1,126 @@
 import os
-import google.generativeai as genai
+import json
+import time
+import hashlib
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 # Load API key
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if not GEMINI_API_KEY:
-    raise ValueError("Missing GEMINI_API_KEY. Set it in the .env file.")
+# Generative models per persona, created on first use and reused for every request
+_models = {}
 
-# Configure Gemini client
-genai.configure(api_key=GEMINI_API_KEY)
+def get_model(selected_persona):
+    """Configure the Gemini client and create the persona's model on first use."""
+    if selected_persona not in _models:
+        if not GEMINI_API_KEY:
+            raise ValueError("Missing GEMINI_API_KEY. Set it in the .env file.")
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _models[selected_persona] = genai.GenerativeModel(
+            'gemini-1.5-flash', system_instruction=persona_system[selected_persona]
+        )
+    return _models[selected_persona]
 
-# Store conversation histories for users
-user_memory = {}
+# Conversation memory limits: at most MAX_MEMORY_TURNS exchanges and roughly
+# MAX_MEMORY_TOKENS tokens (estimated as characters / 4) are kept per user
+MAX_MEMORY_TURNS = 20
+MAX_MEMORY_TOKENS = 6000
+
+class MemoryStore:
+    """Per-user conversation memory, shared through Redis when REDIS_URL is set."""
+
+    def __init__(self, redis_client=None, ttl=3600):
+        self.ttl = ttl
+        self._local = {}
+        self._redis = redis_client
+
+    def get(self, username):
+        """Return the user's record: their messages and estimated token count."""
+        if self._redis is None:
+            record = self._local.get(username)
+        else:
+            data = self._redis.get(f"mem:{username}")
+            record = json.loads(data) if data else None
+        return record or {"messages": [], "tokens": 0}
+
+    def append(self, username, user_input, response_text):
+        """Add one user/model exchange, dropping the oldest ones once over the limits."""
+        record = self.get(username)
+        messages = record["messages"]
+        messages.append({"role": "user", "content": user_input})
+        messages.append({"role": "model", "content": response_text})
+        record["tokens"] += (len(user_input) + len(response_text)) // 4
+        while len(messages) > 2 and (len(messages) > 2 * MAX_MEMORY_TURNS or record["tokens"] > MAX_MEMORY_TOKENS):
+            record["tokens"] -= (len(messages[0]["content"]) + len(messages[1]["content"])) // 4
+            del messages[:2]
+        if self._redis is None:
+            self._local[username] = record
+        else:
+            self._redis.setex(f"mem:{username}", self.ttl, json.dumps(record))
+
+class ResponseCache:
+    """Exact-match cache of replies, shared through Redis when REDIS_URL is set."""
+
+    def __init__(self, redis_client=None, ttl=86400, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = {}
+        self._redis = redis_client
+
+    @staticmethod
+    def make_key(selected_persona, memory, user_input):
+        """Build the cache key for a persona, conversation history and new message."""
+        raw = "\x1f".join((selected_persona, json.dumps(memory), user_input))
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """Return the cached reply for a key, or None."""
+        if self._redis is not None:
+            value = self._redis.get(f"resp:{key}")
+            return value.decode() if value else None
+        entry = self._local.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def set(self, key, response_text):
+        """Cache a reply, evicting the oldest local entry when full."""
+        if self._redis is not None:
+            self._redis.setex(f"resp:{key}", self.ttl, response_text)
+            return
+        if len(self._local) >= self.max_entries:
+            self._local.pop(next(iter(self._local)))
+        self._local[key] = (time.time() + self.ttl, response_text)
+
+def _connect_redis():
+    """Return a Redis client for REDIS_URL, or None to keep everything in process."""
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return None
+    import redis
+    return redis.Redis.from_url(redis_url)
+
+# Store conversation histories for users, and replies for repeated prompts,
+# sharing a single Redis connection pool when REDIS_URL is set
+_redis_client = _connect_redis()
+memory_store = MemoryStore(_redis_client)
+response_cache = ResponseCache(_redis_client)
 
 def get_memory_for_user(username):
-    """Retrieve or create memory for a user."""
-    if username not in user_memory:
-        user_memory[username] = []
-    return user_memory[username]
+    """Retrieve the stored conversation messages for a user."""
+    return memory_store.get(username)["messages"]
+
+# **Persona Descriptions** (read-only, shown in the persona selector)
+PERSONA_OPTIONS = MappingProxyType({
+    "Heavenly DelusionZ Counselor": "The balanced and supportive AI that provides empathetic yet structured mental health support.",
+    "Compassionate Listener": "A deeply empathetic AI that focuses on active listening and validation.",
+    "Motivational Coach": "A high-energy AI that encourages and empowers users to take action for self-improvement.",
+    "CBT Guide": "A rational AI that helps reframe negative thoughts using cognitive behavioral techniques."
+})
+PERSONA_KEYS = tuple(PERSONA_OPTIONS)
 
 # **Persona-Based Prompts**
 persona_prompts = {
@@ -128,48 +229,84 @@ persona_prompts = {
     """
 }
 
-# Function to Get AI Response with Persona Selection
-def get_response(username, user_input, selected_persona="Heavenly DelusionZ Counselor"):
+# Static system prompts: each persona template up to its conversation section.
+# The history itself is sent to Gemini as structured chat messages.
+persona_system = {
+    persona: template.split("Conversation History:")[0].strip()
+    for persona, template in persona_prompts.items()
+}
+
+# Function to Stream AI Response with Persona Selection
+def stream_response(username, user_input, selected_persona="Heavenly DelusionZ Counselor"):
     """
-    Generates a chatbot response based on the selected AI persona.
+    Streams a chatbot response based on the selected AI persona.
+
+    The exchange is saved to the user's memory once the stream completes.
 
     :param username: The user's username.
     :param user_input: The user's input message.
     :param selected_persona: The chosen AI persona.
-    :return: The AI's response.
+    :return: A generator yielding chunks of the AI's response text.
     """
     # Get user memory
     memory = get_memory_for_user(username)
-    
-    # Construct conversation history text
-    history_text = ""
-    for message in memory:
-        role = "user" if message["role"] == "user" else "model"
-        history_text += f"{role}: {message['content']}\n"
-    
-    # Prepare system message with persona prompt
-    prompt = persona_prompts[selected_persona].format(history=history_text, input=user_input)
-    
-    # Initialize the generative model
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
+
+    # Reuse the reply if this exact persona, history and message were seen before
+    cache_key = ResponseCache.make_key(selected_persona, memory, user_input)
+    response_text = response_cache.get(cache_key)
+    if response_text is not None:
+        memory_store.append(username, user_input, response_text)
+        yield response_text
+        return
+
     # Convert history to the format expected by the Gemini API
     gemini_history = []
     for message in memory:
-        role = message["role"]
-        if role == "assistant":
-            role = "model"
+        role = "user" if message["role"] == "user" else "model"
         gemini_history.append({"role": role, "parts": [{"text": message["content"]}]})
 
-    # Start a chat session and send the message
-    chat = model.start_chat(history=gemini_history)
-    response = chat.send_message(prompt)
-    
-    # Extract the response text
-    response_text = response.text
-    
+    # Start a chat session with the persona's system prompt and stream the reply
+    chat = get_model(selected_persona).start_chat(history=gemini_history)
+    chunks = []
+    for chunk in chat.send_message(user_input, stream=True):
+        chunks.append(chunk.text)
+        yield chunk.text
+
+    response_text = "".join(chunks)
+    response_cache.set(cache_key, response_text)
+
     # Update the memory with this exchange
-    memory.append({"role": "user", "content": user_input})
-    memory.append({"role": "model", "content": response_text})
-    
-    return response_text
+    memory_store.append(username, user_input, response_text)
+
+# Group streamed chunks so the UI is updated at most once per interval
+def throttle_stream(chunks, interval=0.05):
+    """
+    Re-yields streamed text, buffering chunks that arrive within `interval` seconds.
+
+    :param chunks: An iterable of text chunks.
+    :param interval: Minimum number of seconds between yields.
+    :return: A generator yielding the buffered text.
+    """
+    buffer = []
+    last_yield = 0.0
+    for chunk in chunks:
+        buffer.append(chunk)
+        now = time.monotonic()
+        if now - last_yield >= interval:
+            yield "".join(buffer)
+            buffer.clear()
+            last_yield = now
+    if buffer:
+        yield "".join(buffer)
+
+# Function to Get AI Response with Persona Selection
+def get_response(username, user_input, selected_persona="Heavenly DelusionZ Counselor"):
+    """
+    Generates a chatbot response based on the selected AI persona.
+
+    :param username: The user's username.
+    :param user_input: The user's input message.
+    :param selected_persona: The chosen AI persona.
+    :return: The AI's response.
+    """
+    return "".join(stream_response(username, user_input, selected_persona))
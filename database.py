@@ -2,6 +2,19 @@ import sqlite3
 import hashlib
 import datetime
 import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Background writer for chat messages; a single worker keeps writes in order.
+# concurrent.futures finishes queued writes before the interpreter exits.
+_executor = ThreadPoolExecutor(max_workers=1)
+
+# Errors from failed background saves, per user, until the app shows them
+_save_errors = {}
+_save_errors_lock = threading.Lock()
 
 # Initialize database
 def init_db():
@@ -112,11 +125,51 @@ def save_chat(session_id, user, message, response):
     conn.commit()
     conn.close()
 
-# Load chat messages from a session
-def load_chat_history(session_id):
+# Save chat messages on the background writer; returns a Future
+def save_chat_async(session_id, user, message, response):
+    future = _executor.submit(save_chat, session_id, user, message, response)
+
+    def record_error(done):
+        error = done.exception()
+        if error is not None:
+            logger.error("Failed to save chat message for session %s", session_id, exc_info=error)
+            with _save_errors_lock:
+                _save_errors.setdefault(user, []).append(error)
+
+    future.add_done_callback(record_error)
+    return future
+
+# Return and forget the errors from a user's failed background saves
+def pop_save_errors(user):
+    with _save_errors_lock:
+        return _save_errors.pop(user, [])
+
+# Load chat messages from a session, optionally only the latest `limit` before `before_id`
+def load_chat_history(session_id, limit=None, before_id=None):
     conn = sqlite3.connect("users.db", timeout=10)
     cursor = conn.cursor()
-    cursor.execute("SELECT message, response FROM chat_messages WHERE session_id=?", (session_id,))
+    query = "SELECT id, message, response FROM chat_messages WHERE session_id=?"
+    params = [session_id]
+    if before_id is not None:
+        query += " AND id<?"
+        params.append(before_id)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    cursor.execute(query, params)
     history = cursor.fetchall()
     conn.close()
-    return history
\ No newline at end of file
+    history.reverse()
+    return history
+
+# Load chat messages from a session as a flat list of role/content messages
+def load_chat_history_as_messages(session_id, limit=None, before_id=None):
+    return [
+        entry
+        for chat_id, message, response in load_chat_history(session_id, limit, before_id)
+        for entry in (
+            {"id": chat_id, "role": "user", "content": message},
+            {"id": chat_id, "role": "assistant", "content": response},
+        )
+    ]